@@ -194,10 +194,7 @@ def argoverse2_get_instance(instance_dir, hidden_size=128, future_frame_num=60,
         start = len(vectors)
 
         for waypoints in [lane_segment.left_lane_boundary.waypoints, lane_segment.right_lane_boundary.waypoints]:
-            polyline = []
-            for point in waypoints:
-                polyline.append(normalizer([point.x, point.y]))
-            polyline = np.array(polyline)
+            polyline = normalizer([[point.x, point.y] for point in waypoints]) # normalize the whole polyline at once
             polygons.append(polyline)
 
             cur_dis = np.min(utils.get_dis_polyline2point(polyline, point_label))
@@ -236,16 +233,10 @@ def argoverse2_get_instance(instance_dir, hidden_size=128, future_frame_num=60,
     left_boundary, right_boundary = ref_lane.left_lane_boundary.waypoints, ref_lane.right_lane_boundary.waypoints
 
     short_boundery = left_boundary if len(left_boundary) < len(right_boundary) else right_boundary
-    short_polyline = []
-    for point in short_boundery:
-        short_polyline.append(normalizer([point.x, point.y]))
-    short_polyline = np.array(short_polyline)
+    short_polyline = normalizer([[point.x, point.y] for point in short_boundery])
 
     long_boundery = left_boundary if len(left_boundary) >= len(right_boundary) else right_boundary
-    long_polyline = []
-    for point in long_boundery:
-        long_polyline.append(normalizer([point.x, point.y]))
-    long_polyline = np.array(long_polyline)
+    long_polyline = normalizer([[point.x, point.y] for point in long_boundery])
 
     for i in range(len(short_polyline)):
         point = short_polyline[i]
@@ -1,5 +1,5 @@
 from typing import Dict, List, Tuple
-from scipy.optimize import minimize
+from scipy.optimize import minimize_scalar
 from torch import Tensor
 import torch
 import math
@@ -30,15 +30,49 @@ def get_from_mapping(mapping: List[Dict], key=None):
     return [each[key] for each in mapping]
 
 
+def cycle(iterable):
+    while True:
+        for x in iterable:
+            yield x
+
+
+"""
+Sample batches (lists of mappings) from the dataset.
+With shuffle, every batch is drawn uniformly at random (with replacement); otherwise the dataset is visited in order.
+"""
+class RandomSampler:
+    def __init__(self, dataset, batch_size, shuffle=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.idx = 0
+        self.length = math.ceil(len(dataset) / batch_size)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for _ in range(self.length):
+            if self.shuffle:
+                indices = np.random.randint(0, len(self.dataset), size=self.batch_size)
+            else:
+                indices = np.arange(self.idx, self.idx + self.batch_size) % len(self.dataset)
+                self.idx = (self.idx + self.batch_size) % len(self.dataset)
+
+            yield [self.dataset[idx] for idx in indices]
+
+
 def get_points_remove_repeated(points, decimal=1):
-    def get_hash_point(point):
-        return round(point[0], decimal), round(point[1], decimal)
-    
-    grid = {}
-    for each in points:
-        grid[get_hash_point(each)] = True
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+    # Pack the quantized (x, y) into a single 64-bit key
+    q = np.round(points * (10 ** decimal)).astype(np.int64)
+    key = (q[:, 0].astype(np.uint64) << np.uint64(32)) | (q[:, 1].astype(np.uint64) & np.uint64(0xFFFFFFFF))
 
-    return list(grid.keys())
+    _, idx = np.unique(key, return_index=True)
+    idx = np.sort(idx) # keep the order of first occurrence
+
+    return np.round(points[idx], decimal)
 
 
 def get_neighbour_points(points, topk_ids=None, mapping=None, neighbour_dis=2):
@@ -57,23 +91,25 @@ def get_neighbour_points(points, topk_ids=None, mapping=None, neighbour_dis=2):
 
 
 def get_neighbour_points_new(points, neighbour_dis=2, density=1.0):
-    grid, eps = {}, 1e-5
+    eps = 1e-5
 
-    for point in points:
-        x, y = round(float(point[0])), round(float(point[1]))
-        if -100 <= x <= 100 and -100 <= y <= 100:
-            i = x - neighbour_dis
-            while i < x + neighbour_dis + eps:
-                j = y - neighbour_dis
-                while j < y + neighbour_dis + eps:
-                    grid[(i, j)] = True
-                    j += density
-                i += density
+    points = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    in_range = np.all((points >= -100) & (points <= 100), axis=1)
+    points = points[in_range]
 
-    points = list(grid.keys())
-    points = get_points_remove_repeated(points, density)
+    # Offsets of the (k, k) grid around each point, flattened to (k^2,)
+    offsets = np.arange(-neighbour_dis, neighbour_dis + eps, density)
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    dx, dy = dx.reshape(-1), dy.reshape(-1)
 
-    return points
+    xs = points[:, 0:1] + dx[None, :] # (N, k^2)
+    ys = points[:, 1:2] + dy[None, :]
+
+    # Remove repeated points, quantizing only the keys (to eps) so that float round-off does not split duplicates
+    grid = np.stack([xs.reshape(-1), ys.reshape(-1)], axis=1)
+    _, idx = np.unique(np.round(grid / eps).astype(np.int64), axis=0, return_index=True)
+
+    return grid[np.sort(idx)]
 
 
 def rotate(x, y, angle):
@@ -89,21 +125,27 @@ class Normalizer:
         self.yaw = yaw
         self.origin = rotate(0.0 - x, 0.0 - y, yaw)
 
+        # Shifts and rotation matrices by yaw (forward) and by -yaw (reverse)
+        c, s = math.cos(yaw), math.sin(yaw)
+        self.shift_fwd = np.array([x, y], dtype=np.float64)
+        self.shift_rev = np.array(self.origin, dtype=np.float64)
+        self.R_fwd = np.array([[c, -s], [s, c]])
+        self.R_rev = self.R_fwd.T
+
     def __call__(self, points, reverse=False):
         points = np.array(points)
         assert 1 <= len(points.shape) <= 3 and 2 <= points.shape[-1] <= 3
-        if len(points.shape) == 3:
-            for each in points:
-                each[:] = self.__call__(each, reverse)
+        if points.shape == (2,): # a single point is cheaper to rotate with scalar arithmetic than with a matmul
+            if reverse:
+                points[0], points[1] = rotate(points[0] - self.origin[0], points[1] - self.origin[1], -self.yaw)
+            else:
+                points[0], points[1] = rotate(points[0] - self.x, points[1] - self.y, self.yaw)
+            return points
+        if reverse:
+            shift, R = self.shift_rev, self.R_rev
         else:
-            point_list = [points] if points.shape == (2,) else [point for point in points]
-            for point in point_list:
-                if reverse:
-                    point[0], point[1] = rotate(point[0] - self.origin[0],
-                                                point[1] - self.origin[1], -self.yaw)
-                else:
-                    point[0], point[1] = rotate(point[0] - self.x,
-                                                point[1] - self.y, self.yaw)
+            shift, R = self.shift_fwd, self.R_fwd
+        points[..., :2] = (points[..., :2] - shift) @ R.T # z-coordinate (if any) is kept
 
         return points
     
@@ -118,7 +160,20 @@ def get_unit_vector(point_a, point_b):
 
 
 def get_dis_batch(points: np.ndarray, point_label):
-    return np.sqrt(np.square((points[:, 0] - point_label[0])) + np.square((points[:, 1] - point_label[1])))
+    xs, ys = points[:, 0], points[:, 1]
+    return np.sqrt(np.square(xs - point_label[0]) + np.square(ys - point_label[1]))
+
+
+"""
+Distances from every query point (shape [M, 2]) to every point (shape [N, 2]), as a matrix of shape [M, N].
+Uses ||p - q||^2 = ||p||^2 + ||q||^2 - 2 p.q so that the cross term is a single matrix product.
+"""
+def get_dis_batch_many(points: np.ndarray, query_points: np.ndarray):
+    points = np.asarray(points, dtype=np.float64)
+    query_points = np.asarray(query_points, dtype=np.float64)
+    squared_dist = np.square(query_points).sum(axis=1)[:, None] + np.square(points).sum(axis=1)[None, :] - 2 * query_points @ points.T
+    np.maximum(squared_dist, 0.0, out=squared_dist) # clamp round-off below zero
+    return np.sqrt(squared_dist, out=squared_dist)
 
 
 def get_dis_p2p(point, point_=(0.0, 0.0)):
@@ -126,30 +181,39 @@ def get_dis_p2p(point, point_=(0.0, 0.0)):
 
 
 def get_dis_segment2point(segment, point):
-    point_a, point_b = segment
-    if get_dis_p2p(point_a, point_b) < 1e-7:
-        return get_dis_p2p(point, point_a)
-    if np.dot(np.array(point) - np.array(point_a), np.array(point_b) - np.array(point_a)) < 0:
-        return get_dis_p2p(point, point_a)
-    if np.dot(np.array(point) - np.array(point_b), np.array(point_a) - np.array(point_b)) < 0:
-        return get_dis_p2p(point, point_b)
-    return np.abs(np.cross(np.array(point_b) - np.array(point_a), np.array(point) - np.array(point_a))) / get_dis_p2p(point_a, point_b)
+    (ax, ay), (bx, by) = segment
+    px, py = point
+    dx, dy = bx - ax, by - ay
+    len2 = dx * dx + dy * dy
+    if len2 < 1e-14:
+        return math.hypot(px - ax, py - ay)
+    if (px - ax) * dx + (py - ay) * dy < 0:
+        return math.hypot(px - ax, py - ay)
+    if (px - bx) * (ax - bx) + (py - by) * (ay - by) < 0:
+        return math.hypot(px - bx, py - by)
+    return abs(dx * (py - ay) - dy * (px - ax)) / math.sqrt(len2)
 
 
 def get_dis_polyline2point(polyline, point):
-    dis = 1e9
-    for i in range(len(polyline) - 1):
-        dis = min(dis, get_dis_segment2point([polyline[i], polyline[i+1]], point))
-    return dis
+    polyline = np.asarray(polyline, dtype=np.float64)
+    if len(polyline) < 2:
+        return 1e9
+
+    # Project the point onto every segment at once, clamping to the segment ends
+    xs, ys = polyline[:, 0], polyline[:, 1]
+    dx, dy = np.diff(xs), np.diff(ys)
+    px, py = point[0] - xs[:-1], point[1] - ys[:-1]
+    len2 = dx * dx + dy * dy
+    degenerate = len2 < 1e-14
+    t = np.clip((px * dx + py * dy) / np.where(degenerate, 1.0, len2), 0.0, 1.0)
+    t[degenerate] = 0.0
+
+    return np.min(np.hypot(px - t * dx, py - t * dy)).item()
     
 
 def get_subdivide_points(polygon, include_self=False, threshold=1.0, include_beside=False, return_unit_vectors=False):
-    average_dis = 0
-    for i, point in enumerate(polygon):
-        if i > 0:
-            average_dis += get_dis_p2p(point, point_pre)
-        point_pre = point
-    average_dis /= len(polygon) - 1
+    xs, ys = np.asarray(polygon, dtype=np.float64)[:, :2].T
+    average_dis = np.hypot(np.diff(xs), np.diff(ys)).sum() / (len(polygon) - 1)
 
     points = []
     if return_unit_vectors:
@@ -194,17 +258,23 @@ def get_subdivide_points(polygon, include_self=False, threshold=1.0, include_bes
 
 
 def construct_reference_path(labels, reference_path, point_label, future_frame_num):
-    # Densify the reference path
-    while len(reference_path) < 9:
-        densified_reference_path = []
-        for i in range(len(reference_path) - 1):
-            densified_reference_path.append(reference_path[i])
-            densified_reference_path.append((reference_path[i] + reference_path[i+1]) / 2) 
-        densified_reference_path.append(reference_path[-1])
-        reference_path = densified_reference_path
+    reference_path = np.array(reference_path, dtype=np.float64)
+
+    # Densify the reference path (as if inserting midpoints repeatedly until there are at least 9 points)
+    num_points = len(reference_path)
+    if 1 < num_points < 9:
+        num_samples = (num_points - 1) * 2 ** math.ceil(math.log2(8 / (num_points - 1))) + 1
+        t = np.linspace(0, num_points - 1, num_samples)
+        idx = np.arange(num_points)
+        reference_path = np.stack(
+            [
+                np.interp(t, idx, reference_path[:, 0]),
+                np.interp(t, idx, reference_path[:, 1])
+            ],
+            axis=1
+        )
 
     # shift the reference path to the target
-    reference_path = np.array(reference_path)
     closest_point_idx = np.argmin(get_dis_batch(reference_path, point_label))
     closest_point = reference_path[closest_point_idx]
     reference_path = reference_path - (closest_point - point_label)
@@ -226,15 +296,10 @@ def construct_reference_path(labels, reference_path, point_label, future_frame_n
         ), 
         3
     )
-    filtered_reference_path = []
-    for point in reference_path:
-        if get_dis_p2p(point, point_label) <= R:
-            filtered_reference_path.append(point)
-
-    reference_path = filtered_reference_path
+    reference_path = reference_path[get_dis_batch(reference_path, point_label) <= R]
 
     # Re-calculate the closest point
-    closest_point_idx = np.argmin(get_dis_batch(np.array(reference_path), point_label))
+    closest_point_idx = np.argmin(get_dis_batch(reference_path, point_label))
 
     # Replace part of the reference path with the trajectory
 
@@ -262,7 +327,7 @@ def construct_reference_path(labels, reference_path, point_label, future_frame_n
             if np.dot(traj_direction, end_direction) > 0:
                 reference_path = traj_segment
             else:
-                reference_path = traj_segment + reference_path[closest_point_idx:] 
+                reference_path = traj_segment + list(reference_path[closest_point_idx:])
 
         # When the target is close to the end of the reference path
         elif end_dist <= 1e-7:
@@ -271,7 +336,7 @@ def construct_reference_path(labels, reference_path, point_label, future_frame_n
             if np.dot(traj_direction, start_direction) > 0:
                 reference_path = traj_segment
             else:
-                reference_path = reference_path[:closest_point_idx] + traj_segment[::-1]
+                reference_path = list(reference_path[:closest_point_idx]) + traj_segment[::-1]
 
         # Other cases
         else:
@@ -282,64 +347,128 @@ def construct_reference_path(labels, reference_path, point_label, future_frame_n
             end_hypo = np.dot(traj_direction, end_direction)
             if start_hypo * end_hypo <= 0 and not (abs(start_hypo) <= 1e-7 and abs(end_hypo) <= 1e-7):
                 if start_hypo < end_hypo: 
-                    reference_path = reference_path[:closest_point_idx] + traj_segment[::-1] # Replace the second part
+                    reference_path = list(reference_path[:closest_point_idx]) + traj_segment[::-1] # Replace the second part
                 else:
-                    reference_path = traj_segment + reference_path[closest_point_idx:] # Replace the first part
+                    reference_path = traj_segment + list(reference_path[closest_point_idx:]) # Replace the first part
 
     return reference_path
 
 
 """
 Find all analytical real roots within the range [a, b] of the cubic equation: c_3 t^3 + c_2 t^2 + c_1 t + c_0 = 0.
+Coefficients may be arrays (broadcast against each other); roots are computed in closed form (Cardano's formula,
+with the trigonometric form when there are three real roots).
+Returns an array of shape [..., 3] where roots outside the range are NaN.
 """
 def solve_cubic(c_3, c_2, c_1, c_0, range=[0, 1]):
-    roots = np.roots([c_3, c_2, c_1, c_0])
-    real_roots_in_range = []
-    for root in roots:
-        if np.isreal(root) and range[0] <= root <= range[1]:
-            real_roots_in_range.append(root)
-    return real_roots_in_range
+    c_3, c_2, c_1, c_0 = np.broadcast_arrays(*[np.asarray(c, dtype=np.float64) for c in (c_3, c_2, c_1, c_0)])
+    roots = np.full(c_3.shape + (3,), np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Depressed cubic s^3 + p s + q = 0 with t = s - a / 3
+        a, b, c = c_2 / c_3, c_1 / c_3, c_0 / c_3
+        p = b - a**2 / 3
+        q = 2 * a**3 / 27 - a * b / 3 + c
+        shift = -a / 3
+        disc = (q / 2)**2 + (p / 3)**3
+
+        # One real root
+        sqrt_disc = np.sqrt(np.maximum(disc, 0.0))
+        one_root = np.cbrt(-q / 2 + sqrt_disc) + np.cbrt(-q / 2 - sqrt_disc) + shift
+
+        # Three real roots
+        three = (disc <= 0) & (p < 0)
+        r = 2 * np.sqrt(np.maximum(-p / 3, 0.0))
+        phi = np.arccos(np.clip(3 * q / (p * r), -1.0, 1.0)) / 3
+        three_roots = r[..., None] * np.cos(phi[..., None] - 2 * np.pi * np.arange(3) / 3) + shift[..., None]
+
+        is_cubic = np.abs(c_3) > 1e-12
+        roots[..., 0] = np.where(is_cubic, one_root, np.nan)
+        roots = np.where((is_cubic & three)[..., None], three_roots, roots)
+
+        # Degenerate case: c_2 t^2 + c_1 t + c_0 = 0
+        is_quadratic = ~is_cubic & (np.abs(c_2) > 1e-12)
+        quad_disc = c_1**2 - 4 * c_2 * c_0
+        sqrt_quad_disc = np.where(quad_disc >= 0, np.sqrt(np.maximum(quad_disc, 0.0)), np.nan)
+        roots[..., 0] = np.where(is_quadratic, (-c_1 + sqrt_quad_disc) / (2 * c_2), roots[..., 0])
+        roots[..., 1] = np.where(is_quadratic, (-c_1 - sqrt_quad_disc) / (2 * c_2), roots[..., 1])
+
+        is_linear = ~is_cubic & ~is_quadratic & (np.abs(c_1) > 1e-12)
+        roots[..., 0] = np.where(is_linear, -c_0 / c_1, roots[..., 0])
+
+    roots[(roots < range[0]) | (roots > range[1])] = np.nan
+    return roots
 
 
 """
-Find the input t_hat that gives the projecction of point (x, y) on the quadratic path Q: (a_2 t^2 + a_1 + a_0, b_2 t^2 + b_1 t + b_0).
+Batched version of inv_proj for points of shape [N, 2].
+Returns t_hat of shape [N] and the projected points of shape [N, 2].
 """
-def inv_proj(point, coeff):
-    x, y = point
-    a_2, a_1, a_0 = coeff["a_2"], coeff["a_1"], coeff["a_0"]
-    b_2, b_1, b_0 = coeff["b_2"], coeff["b_1"], coeff["b_0"]
-
-    c_3 = (4 * a_2**2 + 4 * b_2**2).item()
-    c_2 = (6 * a_1 * a_2 + 6 * b_1 * b_2).item()
-    c_1 = (-4 * a_2 * x + 2 * a_1 ** 2 + 4 * a_0 * a_2 - 4 * b_2 * y + 2 * b_1 ** 2 + 4 * b_0 * b_2).item()
-    c_0 = (-2 * a_1 * x + 2 * a_0 * a_1 - 2 * b_1 * y + 2 * b_0 * b_1).item()
+def inv_proj_batch(points, coeff):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    if isinstance(coeff, dict): # quadratic paths stored by older preprocessing (temp files)
+        coeff = [coeff[key] for key in ("a_2", "a_1", "a_0", "b_2", "b_1", "b_0")]
+    a_2, a_1, a_0, b_2, b_1, b_0 = np.asarray(coeff, dtype=np.float64).reshape(6)
+
+    c_3 = 4 * a_2**2 + 4 * b_2**2
+    c_2 = 6 * a_1 * a_2 + 6 * b_1 * b_2
+    c_1 = -4 * a_2 * x + 2 * a_1 ** 2 + 4 * a_0 * a_2 - 4 * b_2 * y + 2 * b_1 ** 2 + 4 * b_0 * b_2
+    c_0 = -2 * a_1 * x + 2 * a_0 * a_1 - 2 * b_1 * y + 2 * b_0 * b_1
 
     roots = solve_cubic(c_3, c_2, c_1, c_0)
 
-    roots.extend([0.0, 1.0]) # add the boundary into consideration
-
-    t_hat = None
-    min_dist = float('inf')
+    # add the boundary into consideration
+    roots = np.concatenate([roots, np.zeros([len(points), 1]), np.ones([len(points), 1])], axis=1)
 
-    for root in roots:
-        point_hat = (a_2 * root**2 + a_1 * root + a_0, b_2 * root**2 + b_1 * root + b_0)
-        dist = (point[0] - point_hat[0]) ** 2 + (point[1] - point_hat[1]) ** 2
-        if dist < min_dist:
-            min_dist = dist
-            t_hat = root
+    dist = (x[:, None] - (a_2 * roots**2 + a_1 * roots + a_0)) ** 2 + (y[:, None] - (b_2 * roots**2 + b_1 * roots + b_0)) ** 2
+    dist[np.isnan(dist)] = np.inf
+    t_hat = roots[np.arange(len(points)), np.argmin(dist, axis=1)]
 
-    point_hat = (
-        a_2 * t_hat**2 + a_1 * t_hat + a_0,
-        b_2 * t_hat**2 + b_1 * t_hat + b_0
+    point_hat = np.stack(
+        [
+            a_2 * t_hat**2 + a_1 * t_hat + a_0,
+            b_2 * t_hat**2 + b_1 * t_hat + b_0
+        ],
+        axis=1
     )
 
-    return t_hat.real, point_hat
+    return t_hat, point_hat
+
+
+"""
+Find the input t_hat that gives the projecction of point (x, y) on the quadratic path Q: (a_2 t^2 + a_1 + a_0, b_2 t^2 + b_1 t + b_0).
+The coefficients are given as an array [a_2, a_1, a_0, b_2, b_1, b_0].
+"""
+def inv_proj(point, coeff):
+    t_hat, point_hat = inv_proj_batch(point, coeff)
+
+    return t_hat[0], (point_hat[0, 0], point_hat[0, 1])
+
+
+"""
+Use Lagrange interpolation to find the quadratic coefficients for x(t) and y(t),
+such that the path passes through p1, p2 and p3 at t = 0, t and 1 respectively.
+Returns the array [a_2, a_1, a_0, b_2, b_1, b_0].
+"""
+def get_quadratic_coeffs(t, p1, p2, p3):
+    return np.array(
+        [
+            (p1[0] * t - p1[0] + p2[0] - p3[0] * t) / (t**2 - t),
+            (-p1[0] * t**2 + p1[0] - p2[0] + p3[0] * t**2) / (t**2 - t),
+            (p1[0] * t**2 - p1[0] * t) / (t**2 - t),
+            (p1[1] * t - p1[1] + p2[1] - p3[1] * t) / (t**2 - t),
+            (-p1[1] * t**2 + p1[1] - p2[1] + p3[1] * t**2) / (t**2 - t),
+            (p1[1] * t**2 - p1[1] * t) / (t**2 - t)
+        ],
+        dtype=np.float64
+    )
 
 
 """
 Given reference path, use a quadratic path that passes through the two ends of the reference path and the target point.
 Use scipy.optimize to find optimal coefficients with least square error.
-Returns parameters of the quadratic path such that x(t) = a_2 t^2 + a_1 t + a_0, y(t) = b_2 t^2 + b_1 t + b_0.
+Returns parameters [a_2, a_1, a_0, b_2, b_1, b_0] of the quadratic path such that x(t) = a_2 t^2 + a_1 t + a_0, y(t) = b_2 t^2 + b_1 t + b_0.
 """
 def construct_quadratic_path(reference_path, point_label):
 
@@ -362,50 +491,32 @@ def construct_quadratic_path(reference_path, point_label):
     
     if get_dis_p2p(p1, p2) < 1e-7 or get_dis_p2p(p2, p3) < 1e-7:
         return None
-    
-    """
-    Use Lagrange interpolation to find the quadratic coefficients for x(t) and y(t).
-    """
-    def transform(t):
-        interpolated_coeff = {
-            "a_2" : (p1[0] * t - p1[0] + p2[0] - p3[0] * t) / (t**2 - t),
-            "a_1" : (-p1[0] * t**2 + p1[0] - p2[0] + p3[0] * t**2) / (t**2 - t),
-            "a_0" : (p1[0] * t**2 - p1[0] * t) / (t**2 - t),
-            "b_2" : (p1[1] * t - p1[1] + p2[1] - p3[1] * t) / (t**2 - t),
-            "b_1" : (-p1[1] * t**2 + p1[1] - p2[1] + p3[1] * t**2) / (t**2 - t),
-            "b_0" : (p1[1] * t**2 - p1[1] * t) / (t**2 - t)
-        }
-
-        return interpolated_coeff
+
+    p1, p2, p3 = p1.tolist(), p2.tolist(), p3.tolist() # plain floats for the scalar arithmetic below
 
     """
     Compute the least square error between the reference path and the quadratic path.
     Use L2 regularization to prevent overfitting.
     """
     def LSE(t, eta=0.1):
-        coeff = transform(t)
-        a_2, a_1, a_0 = coeff["a_2"], coeff["a_1"], coeff["a_0"]
-        b_2, b_1, b_0 = coeff["b_2"], coeff["b_1"], coeff["b_0"]
+        coeff = get_quadratic_coeffs(t, p1, p2, p3)
 
-        loss = 0
-        for point in reference_path:
-            x, y = point
-            t_hat, _ = inv_proj(point, coeff)
-            loss += (a_2 * t_hat**2 + a_1 * t_hat + a_0 - x)**2 + (b_2 * t_hat**2 + b_1 * t_hat + b_0 - y)**2
+        _, point_hat = inv_proj_batch(reference_path, coeff)
+        loss = np.square(point_hat - reference_path).sum()
 
-        regularized_loss = loss + eta * math.sqrt(a_2**2 + a_1**2 + a_0**2 + b_2**2 + b_1**2 + b_0**2)
+        regularized_loss = loss + eta * math.sqrt(np.square(coeff).sum())
 
         return regularized_loss
     
-    # Use scipy.optimize to find the optimal t_x and t_y in (0, 1)
-    res = minimize(
-        fun=LSE,
-        x0=0.5,
-        method='L-BFGS-B',
-        bounds=[(1e-7, 1-1e-7),], # make sure t is not strictly 0 or 1
+    # Use scipy.optimize (bounded Brent's method) to find the optimal t in (0, 1)
+    res = minimize_scalar(
+        LSE,
+        bounds=(1e-7, 1-1e-7), # make sure t is not strictly 0 or 1
+        method='bounded',
+        options={'xatol': 1e-4},
     )
 
-    return transform(res.x)
+    return get_quadratic_coeffs(res.x, p1, p2, p3)
 
 
 def get_dense_goal_targets_one_hot(dense_goals: np.ndarray, mapping: List[Dict]):
@@ -419,29 +530,24 @@ def get_optimal_targets_home_MR(scores, goals, R=2.0, N=6, output_idx=False):
     ans_points = np.zeros((N, 2), dtype=np.float32)
     ans_idx = np.zeros(N, dtype=np.int32)
 
+    # Pairwise distances between goals, computed once and reused for every center
+    dist = get_dis_batch_many(goals, goals)
+    neighbours = dist < R
+
     start_with_min = True # need to tune
     init_id = 0
     if start_with_min:
         ans_idx[0] = np.argmax(scores)
         ans_points[0] = goals[ans_idx[0]]
-        dist = get_dis_batch(goals, ans_points[0])
-        scores[dist < R] = 0.0
+        scores[neighbours[ans_idx[0]]] = 0.0
         init_id = 1
 
     for i in range(init_id, N):
-        best_center, best_idx, best_score, filter_idx = None, None, -float('inf'), None
-        for idx in range(len(goals)):
-            goal = goals[idx]
-            dist = get_dis_batch(goals, goal)
-            integral = scores[dist < R].sum()
-            if integral > best_score:
-                best_score = integral
-                best_center = goal
-                best_idx = idx
-                filter_idx = (dist < R).copy()
-        ans_points[i] = best_center
+        integrals = neighbours @ scores
+        best_idx = np.argmax(integrals)
+        ans_points[i] = goals[best_idx]
         ans_idx[i] = best_idx
-        scores[filter_idx] = 0.0
+        scores[neighbours[best_idx]] = 0.0
 
     if output_idx:
         return ans_points, ans_idx
@@ -452,18 +558,13 @@ def get_optimal_targets_home_MR(scores, goals, R=2.0, N=6, output_idx=False):
 def get_optimal_targets_home_FDE(scores, goals, centroids, L=3, R=3.0, N=6):
     for _ in range(L):
         # Compute d_i^k the matrix of distance of point x_i to each centroid c_k
-        dist = np.zeros([len(goals), N])
-        for i in range(len(goals)):
-            for k in range(N):
-                dist[i, k] = get_dis_p2p(goals[i], centroids[k])
+        dist = np.linalg.norm(goals[:, None, :] - centroids[None, :, :], axis=2)
 
         m = np.min(dist, axis=1) # the distance of poitn x_i to the closest centroid c_k
 
-        # Compute new centroid coordinates
-        for k in range(N):
-            idx = np.where(dist[:, k] <= R)[0]
-            weights = scores[idx] * (m[idx] + 1e-7) / (dist[idx, k] ** 2 + 1e-7)
-            centroids[k] = np.sum(goals[idx] * weights[:, None], axis=0) / np.sum(weights)
+        # Compute new centroid coordinates (weights of points farther than R from c_k are zero)
+        weights = scores[:, None] * (m[:, None] + 1e-7) / (dist ** 2 + 1e-7) * (dist <= R)
+        centroids[:] = (weights.T @ goals) / np.sum(weights, axis=0)[:, None]
 
     return centroids
 
@@ -471,9 +572,7 @@ def get_optimal_targets_home_FDE(scores, goals, centroids, L=3, R=3.0, N=6):
 def get_optimal_targets_home(scores, goals, N=6):
     centroids = get_optimal_targets_home_MR(np.copy(scores), goals, N=N) # initial centroids with MR optimization
     ans_points = get_optimal_targets_home_FDE(scores, goals, centroids, N=N) # FDE optimization
-    ans_idx = np.zeros(N, dtype=np.int32)
-    for i in range(N):
-        ans_idx[i] = np.argmin(get_dis_batch(goals, ans_points[i]))
+    ans_idx = np.argmin(get_dis_batch_many(goals, ans_points), axis=1).astype(np.int32)
     return ans_points, ans_idx
 
 
@@ -495,8 +594,7 @@ def get_optimal_targets_energy(scores, goals, N=6, init_K=3, min_K=0.1):
     def visit_grid(goal):
         return int(goal[0].item()) - min_coord_x, int(goal[1].item()) - min_coord_y
     
-    for i in range(len(goals)):
-        grid[visit_grid(goals[i])] = i
+    grid[goals[:, 0].astype(int) - min_coord_x, goals[:, 1].astype(int) - min_coord_y] = np.arange(len(goals))
 
     def is_dense(point):
         grid_idx = visit_grid(point)
@@ -521,15 +619,11 @@ def get_optimal_targets_energy(scores, goals, N=6, init_K=3, min_K=0.1):
         ans_points[i] = goals[ans_idx[i]]
         if i > 0 and K > min_K and not is_dense(ans_points[i]):
             K = max(K * 0.5, min_K)
-            potential_energy = scores.copy()
-            for j in range(len(potential_energy)):
-                for k in range(i):
-                    dist = get_dis_p2p(ans_points[k], goals[j])
-                    potential_energy[j] += K / (1e-7 + dist)
+            np.copyto(potential_energy, scores) # reset in place instead of reallocating
+            for k in range(i):
+                potential_energy += K / (1e-7 + get_dis_batch(goals, ans_points[k]))
             continue
-        for j in range(len(potential_energy)):
-            dist = get_dis_p2p(ans_points[i], goals[j])
-            potential_energy[j] += K / (1e-7 + dist)
+        potential_energy += K / (1e-7 + get_dis_batch(goals, ans_points[i]))
         i += 1    
 
     # i = 0
@@ -657,11 +751,10 @@ def select_goals_by_optimization(scores, goals, mapping, N=6):
     for i in range(len(scores)):
         ans_points[i], _ = get_optimal_targets_energy(scores[i], goals[i], N=N) 
 
-    min_FDE = np.zeros(len(scores))
-    MR_counter = np.zeros(len(scores))
-    for i in range(len(scores)):
-        min_FDE[i] = np.min(get_dis_batch(ans_points[i], mapping[i]['labels'][-1]))
-        MR_counter[i] = 1.0 if min_FDE[i] > 2.0 else 0.0
+    # Evaluate the whole batch at once
+    gt_goals = np.array([labels[-1] for labels in get_from_mapping(mapping, 'labels')])
+    min_FDE = np.min(np.linalg.norm(ans_points - gt_goals[:, None, :], axis=-1), axis=1)
+    MR_counter = (min_FDE > 2.0).astype(np.float64)
 
     return ans_points, min_FDE, MR_counter
 
@@ -677,21 +770,16 @@ def get_sse_prep(goals, scores, mapping, m=10.0, eps=3.0, N=6, M=1):
     _, ans_idx = get_optimal_targets_energy(scores, goals, N=int(M*N)) 
     # ans_idx = raw_ans_idx[np.argsort(scores[raw_ans_idx])][:N] # over-sample the optimization result and select the best N
 
-    push_down_idx, push_up_idx = [], []
+    # Classify all selected goals at once
+    selected_goals = goals[ans_idx]
+    dist = get_dis_batch(selected_goals, ground_truth_goal)
+    if compute_traj:
+        _, point_hat = inv_proj_batch(selected_goals, mapping['quadratic_path'])
+        dist += np.hypot(selected_goals[:, 0] - point_hat[:, 0], selected_goals[:, 1] - point_hat[:, 1])
 
-    for idx in ans_idx:
-        goal = goals[idx]
-        goal_dist = get_dis_p2p(goal, ground_truth_goal)
-        if compute_traj:
-            _, point_hat = inv_proj(goal, mapping['quadratic_path'])
-            traj_dist = get_dis_p2p(goal, point_hat).item()
-        else:
-            traj_dist = 0.0
-        dist = goal_dist + traj_dist
-        if dist >= eps and scores[idx] < m:
-            push_up_idx.append(idx)
-        elif dist <= eps:
-            push_down_idx.append(idx)
+    push_up = (dist >= eps) & (scores[ans_idx] < m)
+    push_down = ~push_up & (dist <= eps)
+    push_down_idx, push_up_idx = ans_idx[push_down].tolist(), ans_idx[push_up].tolist()
 
     return target_energy_idx, push_down_idx, push_up_idx
 
@@ -732,8 +820,7 @@ def visualize_heatmap(scores, dense_goals, mapping, star_lst=[], pred=None):
     coeff = mapping['quadratic_path']
     if False and coeff is not None:
         print(coeff)
-        a_2, a_1, a_0 = coeff["a_2"], coeff["a_1"], coeff["a_0"]
-        b_2, b_1, b_0 = coeff["b_2"], coeff["b_1"], coeff["b_0"]
+        a_2, a_1, a_0, b_2, b_1, b_0 = coeff
         t = np.linspace(0, 1, 1000)
         x_t = a_2 * t**2 + a_1 * t + a_0
         y_t = b_2 * t**2 + b_1 * t + b_0